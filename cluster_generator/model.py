@@ -16,24 +16,29 @@ from scipy.integrate import (
     cumulative_trapezoid as cumtrapz,  # compliant with scipy 1.14.0+
 )
 from scipy.integrate import quad
-from scipy.interpolate import InterpolatedUnivariateSpline
+from scipy.interpolate import InterpolatedUnivariateSpline, make_interp_spline
 from unyt import unyt_array, unyt_quantity
 
 from cluster_generator.particles import ClusterParticles
 from cluster_generator.utils import (
     G,
     Self,
+    create_h5_file,
+    cumulative_simpson,
     ensure_ytarray,
     ensure_ytquantity,
     field_label_map,
     generate_particle_radii,
     integrate,
-    integrate_mass,
+    integrate_mass_cumulative,
     kpc_to_cm,
     mp,
     mu,
     mue,
     mylog,
+    read_ytarray_from_h5,
+    spherical_to_cartesian,
+    write_ytarray_to_h5,
 )
 from cluster_generator.virial import VirialEquilibrium
 
@@ -46,6 +51,9 @@ gamma = ft
 et = 8.0 / 3.0
 te = 3.0 / 8.0
 
+# kT in keV of gas with P/rho = 1 kpc**2/Myr**2, i.e. mu*mp*(1 kpc/Myr)**2.
+kev_per_kpc2_myr2 = (mu * mp * unyt_quantity(1.0, "kpc**2/Myr**2")).to_value("keV")
+
 
 class ClusterModel:
     """
@@ -173,40 +181,40 @@ class ClusterModel:
         from cluster_generator.virial import VirialEquilibrium
 
         with h5py.File(filename, "r") as f:
-            fnames = list(f["fields"].keys())
-            get_dm_virial = "dm_df" in f
-            get_star_virial = "star_df" in f
-
-        fields = OrderedDict()
-        for field in fnames:
-            a = unyt_array.from_hdf5(filename, dataset_name=field, group_name="fields")
-            fields[field] = unyt_array(a.d, str(a.units))
-            if field not in cls._keep_units:
-                fields[field].convert_to_base("galactic")
-        if r_min is None:
-            r_min = 0.0
-        if r_max is None:
-            r_max = fields["radius"][-1].d * 2
-        mask = np.logical_and(fields["radius"].d >= r_min, fields["radius"].d <= r_max)
-        for field in fnames:
-            fields[field] = fields[field][mask]
-        num_elements = mask.sum()
+            radius = read_ytarray_from_h5(f["fields"]["radius"])
+            radius.convert_to_base("galactic")
+            if r_min is None:
+                r_min = 0.0
+            if r_max is None:
+                r_max = radius[-1].d * 2
+            mask = np.logical_and(radius.d >= r_min, radius.d <= r_max)
+            num_elements = mask.sum()
+            # Only read the block of rows spanning the kept radii. The radii
+            # are sorted, so normally that block is exactly the kept rows.
+            keep = np.flatnonzero(mask)
+            sel = slice(keep[0], keep[-1] + 1) if keep.size > 0 else slice(0, 0)
+            sub_mask = None if mask[sel].all() else mask[sel]
+
+            def _read(ds):
+                a = read_ytarray_from_h5(ds, sel=sel)
+                return a if sub_mask is None else a[sub_mask]
+
+            fields = OrderedDict()
+            for field, ds in f["fields"].items():
+                a = _read(ds)
+                fields[field] = unyt_array(a.d, str(a.units))
+                if field not in cls._keep_units:
+                    fields[field].convert_to_base("galactic")
+            dm_df = _read(f["dm_df"]) if "dm_df" in f else None
+            star_df = _read(f["star_df"]) if "star_df" in f else None
 
         model = cls(num_elements, fields)
 
-        if get_dm_virial:
-            mask = np.logical_and(
-                fields["radius"].d >= r_min, fields["radius"].d <= r_max
-            )
-            df = unyt_array.from_hdf5(filename, dataset_name="dm_df")[mask]
-            model._dm_virial = VirialEquilibrium(model, ptype="dark_matter", df=df)
+        if dm_df is not None:
+            model._dm_virial = VirialEquilibrium(model, ptype="dark_matter", df=dm_df)
 
-        if get_star_virial:
-            mask = np.logical_and(
-                fields["radius"].d >= r_min, fields["radius"].d <= r_max
-            )
-            df = unyt_array.from_hdf5(filename, dataset_name="star_df")[mask]
-            model._star_virial = VirialEquilibrium(model, ptype="stellar", df=df)
+        if star_df is not None:
+            model._star_virial = VirialEquilibrium(model, ptype="stellar", df=star_df)
 
         return model
 
@@ -218,12 +226,15 @@ class ClusterModel:
     ) -> Self:
         rr = fields["radius"].d
         mylog.info("Integrating gravitational potential profile.")
-        tdens_func = InterpolatedUnivariateSpline(rr, fields["total_density"].d)
-        gpot_profile = lambda r: tdens_func(r) * r
-        gpot1 = fields["total_mass"] / fields["radius"]
-        gpot2 = unyt_array(4.0 * np.pi * integrate(gpot_profile, rr), "Msun/kpc")
-        fields["gravitational_potential"] = -G * (gpot1 + gpot2)
-        fields["gravitational_potential"].convert_to_units("kpc**2/Myr**2")
+        # The integrand is already tabulated on rr, so the outer integral
+        # from r to rmax is the tail of a single cumulative integral, taken
+        # in ln(r) where the profiles are smooth.
+        gpot_int = cumulative_simpson(fields["total_density"].d * rr * rr, np.log(rr))
+        gpot1 = fields["total_mass"].to_value("Msun") / rr
+        gpot2 = 4.0 * np.pi * (gpot_int[-1] - gpot_int)
+        fields["gravitational_potential"] = unyt_array(
+            -G.v * (gpot1 + gpot2), "kpc**2/Myr**2"
+        )
 
         if "density" in fields and "gas_mass" not in fields:
             mylog.info("Integrating gas mass profile.")
@@ -238,7 +249,7 @@ class ClusterModel:
             fields["stellar_density"] = unyt_array(stellar_density(rr), "Msun/kpc**3")
             mylog.info("Integrating stellar mass profile.")
             fields["stellar_mass"] = unyt_array(
-                integrate_mass(stellar_density, rr), "Msun"
+                integrate_mass_cumulative(stellar_density, rr), "Msun"
             )
 
         mdm = fields["total_mass"].copy()
@@ -249,8 +260,9 @@ class ClusterModel:
         if "stellar_mass" in fields:
             mdm -= fields["stellar_mass"]
             ddm -= fields["stellar_density"]
-        mdm[ddm.v < 0.0] = mdm.max()
-        ddm[ddm.v < 0.0] = 0.0
+        negative = ddm.v < 0.0
+        mdm[negative] = mdm.max()
+        ddm[negative] = 0.0
 
         if ddm.sum() < 0.0 or mdm.sum() < 0.0:
             mylog.warning("The total dark matter mass is either zero or negative!!")
@@ -363,14 +375,6 @@ class ClusterModel:
         r_max : float, optional
             The maximum radius.
         """
-        if os.path.exists(output_filename) and not overwrite:
-            raise IOError(
-                f"Cannot create {output_filename}. It exists and overwrite=False."
-            )
-        f = h5py.File(output_filename, "w")
-        f.create_dataset("num_elements", data=self.num_elements)
-        f.attrs["unit_system"] = "cgs" if in_cgs else "galactic"
-        f.close()
         if r_min is None:
             r_min = 0.0
         if r_max is None:
@@ -378,23 +382,23 @@ class ClusterModel:
         mask = np.logical_and(
             self.fields["radius"].d >= r_min, self.fields["radius"].d <= r_max
         )
-        for k, v in self.fields.items():
-            if in_cgs:
-                if k == "temperature":
-                    fd = v[mask].to_equivalent("K", "thermal")
-                elif k not in self._keep_units:
-                    fd = v[mask].in_cgs()
-                else:
-                    fd = v[mask]
-            else:
+        with create_h5_file(output_filename, overwrite) as f:
+            f.create_dataset("num_elements", data=self.num_elements)
+            f.attrs["unit_system"] = "cgs" if in_cgs else "galactic"
+            g = f.create_group("fields")
+            for k, v in self.fields.items():
+                # v[mask] is already a copy, so convert it in place
                 fd = v[mask]
-            fd.write_hdf5(output_filename, dataset_name=k, group_name="fields")
-        if getattr(self, "_dm_virial", None):
-            fd = self.dm_virial.df
-            fd.write_hdf5(output_filename, dataset_name="dm_df")
-        if getattr(self, "_star_virial", None):
-            fd = self.star_virial.df
-            fd.write_hdf5(output_filename, dataset_name="star_df")
+                if in_cgs:
+                    if k == "temperature":
+                        fd.convert_to_equivalent("K", "thermal")
+                    elif k not in self._keep_units:
+                        fd.convert_to_cgs()
+                write_ytarray_to_h5(g, k, fd)
+            if getattr(self, "_dm_virial", None):
+                write_ytarray_to_h5(f, "dm_df", self.dm_virial.df)
+            if getattr(self, "_star_virial", None):
+                write_ytarray_to_h5(f, "star_df", self.star_virial.df)
 
     def write_model_to_binary(
         self,
@@ -424,7 +428,7 @@ class ClusterModel:
             The maximum radius.
         """
         if fields_to_write is None:
-            fields_to_write = list(self.fields.keys())
+            fields_to_write = self.fields
         from scipy.io import FortranFile
 
         if os.path.exists(output_filename) and not overwrite:
@@ -439,19 +443,17 @@ class ClusterModel:
             self.fields["radius"].d >= r_min, self.fields["radius"].d <= r_max
         )
         with FortranFile(output_filename, "w") as f:
-            f.write_record(self.fields["radius"][mask].size)
+            f.write_record(np.count_nonzero(mask))
             prof_rec = []
             for k in fields_to_write:
                 v = self.fields[k]
+                # v[mask] is already a copy, so convert it in place
+                fd = v[mask]
                 if in_cgs:
                     if k == "temperature":
-                        fd = v[mask].to_equivalent("K", "thermal")
+                        fd.convert_to_equivalent("K", "thermal")
                     elif k not in self._keep_units:
-                        fd = v[mask].in_cgs()
-                    else:
-                        fd = v[mask]
-                else:
-                    fd = v[mask]
+                        fd.convert_to_cgs()
                 prof_rec.append(fd)
             f.write_record(np.array(prof_rec).T)
 
@@ -506,16 +508,19 @@ class ClusterModel:
         fields["radius"] = unyt_array(rr, "kpc")
         fields["density"] = unyt_array(density(rr), "Msun/kpc**3")
         fields["temperature"] = unyt_array(temperature(rr), "keV")
-        fields["pressure"] = fields["density"] * fields["temperature"]
-        fields["pressure"] /= mu * mp
-        fields["pressure"].convert_to_units("Msun/(Myr**2*kpc)")
+        fields["pressure"] = unyt_array(
+            fields["density"].d * fields["temperature"].d / kev_per_kpc2_myr2,
+            "Msun/(Myr**2*kpc)",
+        )
         pressure_spline = InterpolatedUnivariateSpline(rr, fields["pressure"].d)
-        dPdr = unyt_array(pressure_spline(rr, 1), "Msun/(Myr**2*kpc**2)")
-        fields["gravitational_field"] = dPdr / fields["density"]
-        fields["gravitational_field"].convert_to_units("kpc/Myr**2")
-        fields["gas_mass"] = unyt_array(integrate_mass(density, rr), "Msun")
-        fields["total_mass"] = (
-            -fields["radius"] ** 2 * fields["gravitational_field"] / G
+        # dP/dr is in Msun/(Myr**2*kpc**2) and the density in Msun/kpc**3,
+        # so the ratio is already in kpc/Myr**2.
+        fields["gravitational_field"] = unyt_array(
+            pressure_spline(rr, 1) / fields["density"].d, "kpc/Myr**2"
+        )
+        fields["gas_mass"] = unyt_array(integrate_mass_cumulative(density, rr), "Msun")
+        fields["total_mass"] = unyt_array(
+            -rr * rr * fields["gravitational_field"].d / G.v, "Msun"
         )
         total_mass_spline = InterpolatedUnivariateSpline(rr, fields["total_mass"].v)
         dMdr = unyt_array(total_mass_spline(rr, nu=1), "Msun/kpc")
@@ -598,13 +603,14 @@ class ClusterModel:
         fields["density"] = unyt_array(density(rr), "Msun/kpc**3")
         fields["total_density"] = unyt_array(total_density(rr), "Msun/kpc**3")
         mylog.info("Integrating total mass profile.")
-        fields["total_mass"] = unyt_array(integrate_mass(total_density, rr), "Msun")
-        fields["gas_mass"] = unyt_array(integrate_mass(density, rr), "Msun")
-        fields["gravitational_field"] = (
-            -G * fields["total_mass"] / (fields["radius"] ** 2)
+        fields["total_mass"] = unyt_array(
+            integrate_mass_cumulative(total_density, rr), "Msun"
+        )
+        fields["gas_mass"] = unyt_array(integrate_mass_cumulative(density, rr), "Msun")
+        fields["gravitational_field"] = unyt_array(
+            -G.v * fields["total_mass"].d / (rr * rr), "kpc/Myr**2"
         )
-        fields["gravitational_field"].convert_to_units("kpc/Myr**2")
-        g = fields["gravitational_field"].in_units("kpc/Myr**2").v
+        g = fields["gravitational_field"].d
         g_r = InterpolatedUnivariateSpline(rr, g)
         dPdr_int = lambda r: density(r) * g_r(r)
         mylog.info("Integrating pressure profile.")
@@ -612,8 +618,9 @@ class ClusterModel:
         dPdr_int2 = lambda r: density(r) * g[-1] * (rr[-1] / r) ** 2
         P -= quad(dPdr_int2, rr[-1], np.inf, limit=100)[0]
         fields["pressure"] = unyt_array(P, "Msun/kpc/Myr**2")
-        fields["temperature"] = fields["pressure"] * mu * mp / fields["density"]
-        fields["temperature"].convert_to_units("keV")
+        fields["temperature"] = unyt_array(
+            P / fields["density"].d * kev_per_kpc2_myr2, "keV"
+        )
 
         return cls._from_scratch(fields, stellar_density=stellar_density)
 
@@ -647,11 +654,12 @@ class ClusterModel:
         fields["radius"] = unyt_array(rr, "kpc")
         fields["total_density"] = unyt_array(total_density(rr), "Msun/kpc**3")
         mylog.info("Integrating total mass profile.")
-        fields["total_mass"] = unyt_array(integrate_mass(total_density, rr), "Msun")
-        fields["gravitational_field"] = (
-            -G * fields["total_mass"] / (fields["radius"] ** 2)
+        fields["total_mass"] = unyt_array(
+            integrate_mass_cumulative(total_density, rr), "Msun"
+        )
+        fields["gravitational_field"] = unyt_array(
+            -G.v * fields["total_mass"].d / (rr * rr), "kpc/Myr**2"
         )
-        fields["gravitational_field"].convert_to_units("kpc/Myr**2")
 
         return cls._from_scratch(fields, stellar_density=stellar_density)
 
@@ -784,7 +792,8 @@ class ClusterModel:
             particle radii, densities, and energies which will then be
             repeated to fill the required number of particles. Default: 1,
             which means no sub-sampling.
-        prng : :class:`~numpy.random.RandomState` object, integer, or None
+        prng : :class:`~numpy.random.RandomState` or
+            :class:`~numpy.random.Generator` object, integer, or None
             A pseudo-random number generator. Typically will only
             be specified if you have a reason to generate the same
             set of random numbers, such as for a test. Default is None,
@@ -811,19 +820,14 @@ class ClusterModel:
         else:
             radius = radius_sub
 
-        theta = np.arccos(prng.uniform(low=-1.0, high=1.0, size=num_particles))
+        cos_theta = prng.uniform(low=-1.0, high=1.0, size=num_particles)
         phi = 2.0 * np.pi * prng.uniform(size=num_particles)
 
         fields = OrderedDict()
 
         fields["tracer", "particle_position"] = unyt_array(
-            [
-                radius * np.sin(theta) * np.cos(phi),
-                radius * np.sin(theta) * np.sin(phi),
-                radius * np.cos(theta),
-            ],
-            "kpc",
-        ).T
+            spherical_to_cartesian(radius, cos_theta, phi), "kpc"
+        )
 
         fields["tracer", "particle_velocity"] = unyt_array(
             np.zeros(fields["tracer", "particle_position"].shape), "kpc/Myr"
@@ -860,7 +864,8 @@ class ClusterModel:
         compute_potential : boolean, optional
             If True, the gravitational potential for each particle will
             be computed. Default: False
-        prng : :class:`~numpy.random.RandomState` object, integer, or None
+        prng : :class:`~numpy.random.RandomState` or
+            :class:`~numpy.random.Generator` object, integer, or None
             A pseudo-random number generator. Typically will only
             be specified if you have a reason to generate the same
             set of random numbers, such as for a test. Default is None,
@@ -887,44 +892,36 @@ class ClusterModel:
         else:
             radius = radius_sub
 
-        theta = np.arccos(prng.uniform(low=-1.0, high=1.0, size=num_particles))
+        cos_theta = prng.uniform(low=-1.0, high=1.0, size=num_particles)
         phi = 2.0 * np.pi * prng.uniform(size=num_particles)
 
         fields = OrderedDict()
 
         fields["gas", "particle_position"] = unyt_array(
-            [
-                radius * np.sin(theta) * np.cos(phi),
-                radius * np.sin(theta) * np.sin(phi),
-                radius * np.cos(theta),
-            ],
-            "kpc",
-        ).T
+            spherical_to_cartesian(radius, cos_theta, phi), "kpc"
+        )
 
         mylog.info("Compute particle thermal energies, densities, and masses.")
 
+        # Energy and density share the same knots, so interpolate both
+        # through a single spline over the stacked table.
         e_arr = 1.5 * self.fields["pressure"] / self.fields["density"]
-        get_energy = InterpolatedUnivariateSpline(self.fields["radius"], e_arr)
+        get_gas = make_interp_spline(
+            self.fields["radius"].d,
+            np.vstack([e_arr.d, self.fields["density"].d]),
+            k=3,
+            axis=1,
+        )
+        energy, density = get_gas(radius_sub)
 
         if sub_sample > 1:
-            energy = np.tile(get_energy(radius_sub), sub_sample)[:num_particles]
-        else:
-            energy = get_energy(radius)
+            energy = np.tile(energy, sub_sample)[:num_particles]
+            density = np.tile(density, sub_sample)[:num_particles]
 
         fields["gas", "thermal_energy"] = unyt_array(energy, "kpc**2/Myr**2")
         fields["gas", "particle_mass"] = unyt_array(
             [mtot / num_particles] * num_particles, "Msun"
         )
-
-        get_density = InterpolatedUnivariateSpline(
-            self.fields["radius"], self.fields["density"]
-        )
-
-        if sub_sample > 1:
-            density = np.tile(get_density(radius_sub), sub_sample)[:num_particles]
-        else:
-            density = get_density(radius)
-
         fields["gas", "density"] = unyt_array(density, "Msun/kpc**3")
 
         mylog.info("Set particle velocities to zero.")
@@ -971,7 +968,8 @@ class ClusterModel:
         compute_potential : boolean, optional
             If True, the gravitational potential for each particle will
             be computed. Default: False
-        prng : :class:`~numpy.random.RandomState` object, integer, or None
+        prng : :class:`~numpy.random.RandomState` or
+            :class:`~numpy.random.Generator` object, integer, or None
             A pseudo-random number generator. Typically will only
             be specified if you have a reason to generate the same
             set of random numbers, such as for a test. Default is None,
@@ -1017,7 +1015,8 @@ class ClusterModel:
         compute_potential : boolean, optional
             If True, the gravitational potential for each particle will
             be computed. Default: False
-        prng : :class:`~numpy.random.RandomState` object, integer, or None
+        prng : :class:`~numpy.random.RandomState` or
+            :class:`~numpy.random.Generator` object, integer, or None
             A pseudo-random number generator. Typically will only
             be specified if you have a reason to generate the same
             set of random numbers, such as for a test. Default is None,
@@ -127,3 +127,40 @@ def div_clean(np.ndarray[CTYPE_t, ndim=3] gx,
                 gx[i,j,k] = ggx - kxd * kg
                 gy[i,j,k] = ggy - kyd * kg
                 gz[i,j,k] = ggz - kzd * kg
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def radial_mask(np.ndarray[DTYPE_t, ndim=2] pos,
+                np.ndarray[DTYPE_t, ndim=1] center,
+                DTYPE_t r2):
+    cdef Py_ssize_t i, num_particles
+    cdef DTYPE_t dx, dy, dz
+    cdef np.ndarray[np.uint8_t, ndim=1] mask
+
+    num_particles = pos.shape[0]
+    mask = np.empty(num_particles, dtype='uint8')
+    for i in range(num_particles):
+        dx = pos[i,0] - center[0]
+        dy = pos[i,1] - center[1]
+        dz = pos[i,2] - center[2]
+        mask[i] = dx*dx + dy*dy + dz*dz <= r2
+    return mask.view('bool')
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def box_mask(np.ndarray[DTYPE_t, ndim=2] pos,
+             DTYPE_t box_size):
+    cdef Py_ssize_t i, num_particles
+    cdef DTYPE_t x, y, z
+    cdef np.ndarray[np.uint8_t, ndim=1] mask
+
+    num_particles = pos.shape[0]
+    mask = np.empty(num_particles, dtype='uint8')
+    for i in range(num_particles):
+        x = pos[i,0]
+        y = pos[i,1]
+        z = pos[i,2]
+        mask[i] = (0.0 <= x <= box_size) and (0.0 <= y <= box_size) and (0.0 <= z <= box_size)
+    return mask.view('bool')
@@ -1,14 +1,23 @@
 """Initial conditions and cluster model particle management module."""
 
 from collections import OrderedDict, defaultdict
-from pathlib import Path
 
 import h5py
 import numpy as np
-from scipy.interpolate import InterpolatedUnivariateSpline
-from unyt import uconcatenate, unyt_array
-
-from cluster_generator.utils import ensure_list, ensure_ytarray, mylog
+from scipy.interpolate import make_interp_spline
+from unyt import unyt_array, unyt_quantity
+
+from cluster_generator.opt.cython_utils import box_mask, radial_mask
+from cluster_generator.utils import (
+    auto_chunks,
+    create_h5_file,
+    ensure_list,
+    ensure_ytarray,
+    ensure_ytquantity,
+    mylog,
+    read_ytarray_from_h5,
+    write_ytarray_to_h5,
+)
 
 gadget_fields = {
     "dm": ["Coordinates", "Velocities", "Masses", "ParticleIDs", "Potential"],
@@ -75,6 +84,21 @@ ptype_map = OrderedDict(
 rptype_map = OrderedDict([(v, k) for k, v in ptype_map.items()])
 
 
+def _as_units(arr, units, out, idxs):
+    # Write arr[idxs] converted to units into the preallocated out. A slice
+    # is read straight through without gathering a copy of the input first.
+    # The factor goes through unyt_quantity.to_value so that conversions
+    # between SI and CGS electromagnetic units (e.g. T -> gauss) still work.
+    factor = unyt_quantity(1.0, arr.units).to_value(units)
+    if isinstance(idxs, slice):
+        return np.multiply(arr.d[idxs], factor, out=out)
+    if out.dtype == arr.dtype:
+        np.compress(idxs, arr.d, axis=0, out=out)
+        out *= factor
+        return out
+    return np.multiply(np.compress(idxs, arr.d, axis=0), factor, out=out)
+
+
 class ClusterParticles:
     def __init__(self, particle_types, fields):
         self.particle_types = ensure_list(particle_types)
@@ -103,16 +127,27 @@ class ClusterParticles:
             self.field_names[field[0]].append(field[1])
 
     def _clip_to_box(self, ptype, box_size):
-        pos = self.fields[ptype, "particle_position"]
-        return ~np.logical_or((pos < 0.0).any(axis=1), (pos > box_size).any(axis=1))
+        box_size = float(ensure_ytquantity(box_size, "kpc").v)
+        pos = self.fields[ptype, "particle_position"].to_value("kpc")
+        return box_mask(np.asarray(pos, dtype="float64"), box_size)
 
     def __add__(self, other):
         fields = self.fields.copy()
         for field in other.fields:
             if field in fields:
-                fields[field] = uconcatenate(
-                    [self[field], other[field]]
-                )  # TODO: future deprecation anticipated.
+                a, b = self[field], other[field]
+                n1 = a.shape[0]
+                out = np.empty(
+                    (n1 + b.shape[0],) + a.shape[1:], dtype=np.result_type(a, b)
+                )
+                if isinstance(a, unyt_array):
+                    out[:n1] = a.d
+                    out[n1:] = b.to(a.units).d
+                    out = unyt_array(out, a.units)
+                else:
+                    out[:n1] = a
+                    out[n1:] = b
+                fields[field] = out
             else:
                 fields[field] = other[field]
         particle_types = list(set(self.particle_types + other.particle_types))
@@ -129,10 +164,8 @@ class ClusterParticles:
         ptypes = ensure_list(ptypes)
         for ptype in ptypes:
             self.particle_types.remove(ptype)
-            names = list(self.fields.keys())
-            for name in names:
-                if name[0] in ptypes:
-                    self.fields.pop(name)
+            for name in self.field_names.pop(ptype, []):
+                self.fields.pop((ptype, name))
         self._update_num_particles()
         self._update_field_names()
 
@@ -152,19 +185,21 @@ class ClusterParticles:
             The particle types to perform the radial cut on. If
             not set, all will be exported.
         """
+        r_max = float(ensure_ytquantity(r_max, "kpc").v)
         rm2 = r_max * r_max
         if center is None:
             center = np.array([0.0] * 3)
+        center = np.asarray(ensure_ytarray(center, "kpc").d, dtype="float64")
         if ptypes is None:
             ptypes = self.particle_types
         ptypes = ensure_list(ptypes)
 
         for part in ptypes:
-            cidx = ((self[part, "particle_position"].d - center) ** 2).sum(
-                axis=1
-            ) <= rm2
+            pos = self[part, "particle_position"].to_value("kpc")
+            pos = np.asarray(pos, dtype="float64")
+            keep = np.flatnonzero(radial_mask(pos, center, rm2))
             for field in self.field_names[part]:
-                self.fields[part, field] = self.fields[part, field][cidx]
+                self.fields[part, field] = self.fields[part, field][keep]
         self._update_num_particles()
 
     def add_black_hole(self, bh_mass, pos=None, vel=None, use_pot_min=False):
@@ -251,26 +286,19 @@ class ClusterParticles:
             dm_particles = ClusterParticles.from_file("dm_particles.h5")
 
         """
-        names = {}
-        with h5py.File(filename, "r") as f:
+        fields = OrderedDict()
+        with h5py.File(filename, "r", rdcc_nbytes=4 << 20) as f:
             if ptypes is None:
                 ptypes = list(f.keys())
             ptypes = ensure_list(ptypes)
             for ptype in ptypes:
-                names[ptype] = list(f[ptype].keys())
-        fields = OrderedDict()
-        for ptype in ptypes:
-            for field in names[ptype]:
-                if field == "particle_index":
-                    with h5py.File(filename, "r") as f:
-                        fields[ptype, field] = f[ptype][field][:]
-                else:
-                    a = unyt_array.from_hdf5(
-                        filename, dataset_name=field, group_name=ptype
-                    )
-                    fields[ptype, field] = unyt_array(
-                        a.d.astype("float64"), str(a.units)
-                    ).in_base("galactic")
+                for field, ds in f[ptype].items():
+                    if field == "particle_index":
+                        fields[ptype, field] = ds[()]
+                    else:
+                        a = read_ytarray_from_h5(ds, dtype="float64")
+                        a.convert_to_base("galactic")
+                        fields[ptype, field] = a
         return cls(ptypes, fields)
 
     @classmethod
@@ -345,22 +373,20 @@ class ClusterParticles:
         overwrite : boolean, optional
             Overwrite an existing file with the same name. Default False.
         """
-        if Path(output_filename).exists() and not overwrite:
-            raise IOError(
-                f"Cannot create {output_filename}. It exists and overwrite=False."
-            )
-        with h5py.File(output_filename, "w") as f:
+        with create_h5_file(output_filename, overwrite) as f:
             for ptype in self.particle_types:
                 f.create_group(ptype)
-        for field in self.fields:
-            if field[1] == "particle_index":
-                with h5py.File(output_filename, "r+") as f:
-                    g = f[field[0]]
-                    g.create_dataset("particle_index", data=self.fields[field])
-            else:
-                self.fields[field].write_hdf5(
-                    output_filename, dataset_name=field[1], group_name=field[0]
-                )
+            for field, fd in self.fields.items():
+                g = f.require_group(field[0])
+                chunks = auto_chunks(fd.shape, fd.dtype.itemsize)
+                if chunks is None:
+                    kwargs = {}
+                else:
+                    kwargs = {"chunks": chunks}
+                if field[1] == "particle_index":
+                    g.create_dataset("particle_index", data=fd, **kwargs)
+                else:
+                    write_ytarray_to_h5(g, field[1], fd, **kwargs)
 
     def write_particles_to_h5(self, output_filename, overwrite=False):
         self.write_particles(output_filename, overwrite=overwrite)
@@ -453,7 +479,13 @@ class ClusterParticles:
     def _write_gadget_fields(self, ptype, h5_group, idxs, dtype, code):
         fields = gadget_fields[ptype]
         if code in code_fields:
-            fields += code_fields[code].get(ptype, [])
+            fields = fields + code_fields[code].get(ptype, [])
+        # Fields of the same shape (e.g. positions and velocities) share
+        # one output buffer, since each is written out before the next
+        scratch = {}
+        num_particles = np.count_nonzero(idxs)
+        if num_particles == idxs.size:
+            idxs = slice(None)
         for field in fields:
             if field == "ParticleIDs":
                 # these are handled later
@@ -461,16 +493,29 @@ class ClusterParticles:
             if field == "PassiveScalars":
                 if self.num_passive_scalars > 0:
                     data = np.stack(
-                        [self[ptype, s].d for s in self.passive_scalars], axis=-1
+                        [self[ptype, s].d[idxs] for s in self.passive_scalars],
+                        axis=-1,
+                    )
+                    h5_group.create_dataset(
+                        "PassiveScalars",
+                        data=data,
+                        chunks=auto_chunks(data.shape, data.dtype.itemsize),
                     )
-                    h5_group.create_dataset("PassiveScalars", data=data)
             else:
                 my_field = gadget_field_map[field]
                 if (ptype, my_field) in self.fields:
-                    units = gadget_field_units[field]
                     fd = self.fields[ptype, my_field]
-                    data = fd[idxs].to(units).d.astype(dtype)
-                    h5_group.create_dataset(field, data=data)
+                    shape = (num_particles,) + fd.shape[1:]
+                    if shape not in scratch:
+                        scratch[shape] = np.empty(shape, dtype=dtype)
+                    data = _as_units(
+                        fd, gadget_field_units[field], scratch[shape], idxs
+                    )
+                    h5_group.create_dataset(
+                        field,
+                        data=data,
+                        chunks=auto_chunks(data.shape, data.dtype.itemsize),
+                    )
 
     def write_to_gadget_file(
         self, ic_filename, box_size, dtype="float32", overwrite=False, code=None
@@ -496,60 +541,57 @@ class ClusterParticles:
             the file so that it can be identified by yt as belonging
             to a specific frontend. Default: None
         """
-        if Path(ic_filename).exists() and not overwrite:
-            raise IOError(
-                f"Cannot create {ic_filename}. It exists and " f"overwrite=False."
-            )
         num_particles = {}
         npart = 0
         mass_table = np.zeros(6)
-        f = h5py.File(ic_filename, "w")
-        for ptype in self.particle_types:
-            gptype = rptype_map[ptype]
-            idxs = self._clip_to_box(ptype, box_size)
-            num_particles[ptype] = idxs.sum()
-            g = f.create_group(gptype)
-            self._write_gadget_fields(ptype, g, idxs, dtype, code)
-            ids = np.arange(num_particles[ptype]) + 1 + npart
-            g.create_dataset("ParticleIDs", data=ids.astype("uint32"))
-            npart += num_particles[ptype]
-            if ptype in ["star", "dm", "black_hole"]:
-                mass_table[int(rptype_map[ptype][-1])] = g["Masses"][0]
-        f.flush()
-        hg = f.create_group("Header")
-        hg.attrs["Time"] = 0.0
-        hg.attrs["Redshift"] = 0.0
-        hg.attrs["BoxSize"] = box_size
-        hg.attrs["Omega0"] = 0.0
-        hg.attrs["OmegaLambda"] = 0.0
-        hg.attrs["HubbleParam"] = 1.0
-        hg.attrs["NumPart_ThisFile"] = np.array(
-            [
-                num_particles.get("gas", 0),
-                num_particles.get("dm", 0),
-                num_particles.get("tracer", 0),
-                0,
-                num_particles.get("star", 0),
-                num_particles.get("black_hole", 0),
-            ],
-            dtype="uint32",
-        )
-        hg.attrs["NumPart_Total"] = hg.attrs["NumPart_ThisFile"]
-        hg.attrs["NumPart_Total_HighWord"] = np.zeros(6, dtype="uint32")
-        hg.attrs["NumFilesPerSnapshot"] = 1
-        hg.attrs["MassTable"] = mass_table
-        hg.attrs["Flag_Sfr"] = 0
-        hg.attrs["Flag_Cooling"] = 0
-        hg.attrs["Flag_StellarAge"] = 0
-        hg.attrs["Flag_Metals"] = 0
-        hg.attrs["Flag_Feedback"] = 0
-        hg.attrs["Flag_DoublePrecision"] = 0
-        hg.attrs["Flag_IC_Info"] = 0
-        if code == "arepo":
-            cg = f.create_group("Config")
-            cg.attrs["VORONOI"] = 1
-        f.flush()
-        f.close()
+        with create_h5_file(ic_filename, overwrite, rdcc_nbytes=4 << 20) as f:
+            for ptype in self.particle_types:
+                gptype = rptype_map[ptype]
+                idxs = self._clip_to_box(ptype, box_size)
+                num_particles[ptype] = idxs.sum()
+                g = f.create_group(gptype)
+                self._write_gadget_fields(ptype, g, idxs, dtype, code)
+                ids = np.arange(
+                    npart + 1, npart + 1 + num_particles[ptype], dtype="uint32"
+                )
+                g.create_dataset(
+                    "ParticleIDs", data=ids, chunks=auto_chunks(ids.shape, 4)
+                )
+                npart += num_particles[ptype]
+                if ptype in ["star", "dm", "black_hole"]:
+                    mass_table[int(rptype_map[ptype][-1])] = g["Masses"][0]
+            hg = f.create_group("Header")
+            hg.attrs["Time"] = 0.0
+            hg.attrs["Redshift"] = 0.0
+            hg.attrs["BoxSize"] = box_size
+            hg.attrs["Omega0"] = 0.0
+            hg.attrs["OmegaLambda"] = 0.0
+            hg.attrs["HubbleParam"] = 1.0
+            hg.attrs["NumPart_ThisFile"] = np.array(
+                [
+                    num_particles.get("gas", 0),
+                    num_particles.get("dm", 0),
+                    num_particles.get("tracer", 0),
+                    0,
+                    num_particles.get("star", 0),
+                    num_particles.get("black_hole", 0),
+                ],
+                dtype="uint32",
+            )
+            hg.attrs["NumPart_Total"] = hg.attrs["NumPart_ThisFile"]
+            hg.attrs["NumPart_Total_HighWord"] = np.zeros(6, dtype="uint32")
+            hg.attrs["NumFilesPerSnapshot"] = 1
+            hg.attrs["MassTable"] = mass_table
+            hg.attrs["Flag_Sfr"] = 0
+            hg.attrs["Flag_Cooling"] = 0
+            hg.attrs["Flag_StellarAge"] = 0
+            hg.attrs["Flag_Metals"] = 0
+            hg.attrs["Flag_Feedback"] = 0
+            hg.attrs["Flag_DoublePrecision"] = 0
+            hg.attrs["Flag_IC_Info"] = 0
+            if code == "arepo":
+                cg = f.create_group("Config")
+                cg.attrs["VORONOI"] = 1
 
     def to_yt_dataset(self, box_size, ptypes=None):
         """
@@ -565,16 +607,22 @@ class ClusterParticles:
         """
         from yt import load_particles
 
-        data = self.fields.copy()
         if ptypes is None:
             ptypes = self.particle_types
         ptypes = ensure_list(ptypes)
+        vector_fields = ("particle_position", "particle_velocity")
+        data = {
+            k: v
+            for k, v in self.fields.items()
+            if k[0] not in ptypes or k[1] not in vector_fields
+        }
         for ptype in ptypes:
-            pos = data.pop((ptype, "particle_position"))
-            vel = data.pop((ptype, "particle_velocity"))
-            for i, ax in enumerate("xyz"):
-                data[ptype, f"particle_position_{ax}"] = pos[:, i]
-                data[ptype, f"particle_velocity_{ax}"] = vel[:, i]
+            for field in vector_fields:
+                fd = self.fields[ptype, field]
+                # one transposed copy gives each axis its own contiguous column
+                cols = np.ascontiguousarray(fd.d.T)
+                for i, ax in enumerate("xyz"):
+                    data[ptype, f"{field}_{ax}"] = unyt_array(cols[i], fd.units)
         return load_particles(
             data,
             length_unit="kpc",
@@ -612,16 +660,19 @@ def _sample_clusters(
             mylog.warning("No density field found in %s. Skipping.", hse)
             continue
 
-        get_density = InterpolatedUnivariateSpline(hse["radius"], hse["density"])
-        d[i, :] = get_density(r[i, :])
+        # Density, energy and any passive scalars share the same knots, so
+        # interpolate them all through a single spline over a stacked table.
         e_arr = 1.5 * hse["pressure"] / hse["density"]
-        get_energy = InterpolatedUnivariateSpline(hse["radius"], e_arr)
-        e[i, :] = get_energy(r[i, :]) * d[i, :]
+        table = [hse["density"].d, e_arr.d]
+        if num_scalars > 0:
+            table += [hse[name].d for name in passive_scalars]
+        get_gas = make_interp_spline(hse["radius"].d, np.vstack(table), k=3, axis=1)
+        vals = get_gas(r[i, :])
+        d[i, :] = vals[0]
+        e[i, :] = vals[1] * d[i, :]
         m[i, :, :] = velocity[i].d[:, np.newaxis] * d[i, :]
         if num_scalars > 0:
-            for j, name in enumerate(passive_scalars):
-                get_scalar = InterpolatedUnivariateSpline(hse["radius"], hse[name])
-                s[i, j, :] = get_scalar(r[i, :]) * d[i, :]
+            s[i, :, :] = vals[2:] * d[i, :]
     dens = d.sum(axis=0)
     eint = e.sum(axis=0) / dens
     mom = m.sum(axis=0) / dens
@@ -734,11 +785,12 @@ def resample_one_cluster(particles, hse, center, velocity):
     velocity = ensure_ytarray(velocity, "kpc/Myr")
     r = ((particles["gas", "particle_position"] - center) ** 2).sum(axis=1).d
     np.sqrt(r, r)
-    get_density = InterpolatedUnivariateSpline(hse["radius"], hse["density"])
-    dens = get_density(r)
     e_arr = 1.5 * hse["pressure"] / hse["density"]
-    get_energy = InterpolatedUnivariateSpline(hse["radius"], e_arr)
-    particles["gas", "thermal_energy"] = unyt_array(get_energy(r), "kpc**2/Myr**2")
+    get_gas = make_interp_spline(
+        hse["radius"].d, np.vstack([hse["density"].d, e_arr.d]), k=3, axis=1
+    )
+    dens, eint = get_gas(r)
+    particles["gas", "thermal_energy"] = unyt_array(eint, "kpc**2/Myr**2")
     vol = particles["gas", "particle_mass"] / particles["gas", "density"]
     particles["gas", "particle_mass"] = unyt_array(dens * vol.d, "Msun")
     particles["gas", "particle_velocity"][:, :] = velocity
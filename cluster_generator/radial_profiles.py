@@ -1,8 +1,29 @@
+from functools import lru_cache
+
 import numpy as np
 
 _nfw_factor = lambda conc: 1.0 / (np.log(conc + 1.0) - conc / (1.0 + conc))
 
 
+@lru_cache(maxsize=128)
+def _default_critical_density(z):
+    from yt.utilities.cosmology import Cosmology
+
+    return Cosmology().critical_density(z).to_value("Msun/kpc**3")
+
+
+def _critical_density(z, cosmo):
+    # Building a default yt Cosmology is costly, so its critical density is
+    # cached per (scalar) redshift; explicit cosmologies are used as given.
+    if cosmo is None:
+        if np.isscalar(z):
+            return _default_critical_density(float(z))
+        from yt.utilities.cosmology import Cosmology
+
+        cosmo = Cosmology()
+    return cosmo.critical_density(z).to_value("Msun/kpc**3")
+
+
 class RadialProfile:
     def __init__(self, profile):
         if isinstance(profile, RadialProfile):
@@ -58,8 +79,9 @@ class RadialProfile:
     def cutoff(self, r_cut, k=5):
         def _cutoff(r):
             x = r / r_cut
-            step = 1.0 / (1.0 + np.exp(-2 * k * (x - 1)))
-            p = self.profile(r) * (1.0 - step)
+            # 1 - 1 / (1 + exp(-2k(x - 1))) written as a single tanh, which
+            # cannot overflow for steep cutoffs.
+            p = self.profile(r) * (0.5 * (1.0 - np.tanh(k * (x - 1.0))))
             return p
 
         return RadialProfile(_cutoff)
@@ -182,8 +204,14 @@ def hernquist_density_profile(M_0, a):
     a : float
         The scale radius in kpc.
     """
-    p = lambda r: M_0 / (2.0 * np.pi * a**3) / ((r / a) * (1.0 + r / a) ** 3)
-    return RadialProfile(p)
+    rho_0 = M_0 / (2.0 * np.pi * a**3)
+
+    def _hernquist(r):
+        x = r / a
+        t = 1.0 + x
+        return rho_0 / (x * t * t * t)
+
+    return RadialProfile(_hernquist)
 
 
 def cored_hernquist_density_profile(M_0, a, b):
@@ -200,13 +228,14 @@ def cored_hernquist_density_profile(M_0, a, b):
     b : float
         The core radius in kpc.
     """
-    p = (
-        lambda r: M_0
-        * b
-        / (2.0 * np.pi * a**3)
-        / ((1.0 + b * r / a) * (1.0 + r / a) ** 3)
-    )
-    return RadialProfile(p)
+    rho_0 = M_0 * b / (2.0 * np.pi * a**3)
+
+    def _hernquist(r):
+        x = r / a
+        t = 1.0 + x
+        return rho_0 / ((1.0 + b * x) * t * t * t)
+
+    return RadialProfile(_hernquist)
 
 
 def hernquist_mass_profile(M_0, a):
@@ -258,8 +287,12 @@ def nfw_density_profile(rho_s, r_s):
     r_s : float
         The scale radius in kpc.
     """
-    p = lambda r: rho_s / ((r / r_s) * (1.0 + r / r_s) ** 2)
-    return RadialProfile(p)
+
+    def _nfw(r):
+        x = r / r_s
+        return rho_s / (x * (1.0 + x) ** 2)
+
+    return RadialProfile(_nfw)
 
 
 def nfw_mass_profile(rho_s, r_s):
@@ -275,9 +308,11 @@ def nfw_mass_profile(rho_s, r_s):
         The scale radius in kpc.
     """
 
+    m_s = 4 * np.pi * rho_s * r_s**3
+
     def _nfw(r):
         x = r / r_s
-        return 4 * np.pi * rho_s * r_s**3 * (np.log(1 + x) - x / (1 + x))
+        return m_s * (np.log(1 + x) - x / (1 + x))
 
     return RadialProfile(_nfw)
 
@@ -304,11 +339,7 @@ def nfw_scale_density(conc, z=0.0, delta=200.0, cosmo=None):
         density. If not supplied, a default one from yt will
         be used.
     """
-    from yt.utilities.cosmology import Cosmology
-
-    if cosmo is None:
-        cosmo = Cosmology()
-    rho_crit = cosmo.critical_density(z).to_value("Msun/kpc**3")
+    rho_crit = _critical_density(z, cosmo)
     rho_s = delta * rho_crit * conc**3 * _nfw_factor(conc) / 3.0
     return rho_s
 
@@ -329,7 +360,8 @@ def tnfw_density_profile(rho_s, r_s, r_t):
     """
 
     def _tnfw(r):
-        profile = rho_s / ((r / r_s) * (1 + r / r_s) ** 2)
+        x = r / r_s
+        profile = rho_s / (x * (1 + x) ** 2)
         profile /= 1 + (r / r_t) ** 2
         return profile
 
@@ -350,18 +382,19 @@ def tnfw_mass_profile(rho_s, r_s, r_t):
     r_t : float
         The truncation radius in kpc.
     """
-    from sympy import Symbol, integrate, lambdify
-
-    xx = Symbol("x")
-    aa = Symbol("a")
-    yy = Symbol("y")
-    f = integrate(xx**2 / (xx * (1 + xx) ** 2) / (1 + (xx / aa) ** 2), (xx, 0, yy))
-    fl = lambdify((yy, aa), f, modules="numpy")
+    # Closed-form integral of x / ((1 + x)**2 * (1 + (x / a)**2)) from 0 to x,
+    # from a partial-fraction decomposition of the integrand.
+    a = r_t / r_s
+    a2 = a * a
+    norm = 4 * np.pi * rho_s * r_s**3 * a2 / (1.0 + a2) ** 2
 
     def _tnfw(r):
         x = r / r_s
-        a = r_t / r_s
-        return 4 * np.pi * rho_s * r_s**3 * fl(x, a).real
+        m = (a2 - 1.0) * np.log1p(x)
+        m -= (1.0 + a2) * x / (1.0 + x)
+        m += 0.5 * (1.0 - a2) * np.log1p((x / a) ** 2)
+        m += 2.0 * a * np.arctan(x / a)
+        return norm * m
 
     return RadialProfile(_tnfw)
 
@@ -378,10 +411,12 @@ def snfw_density_profile(M, a):
     a : float
         The scale radius in kpc.
     """
+    rho_0 = 3.0 * M / (16.0 * np.pi * a**3)
 
     def _snfw(r):
         x = r / a
-        return 3.0 * M / (16.0 * np.pi * a**3) / (x * (1.0 + x) ** 2.5)
+        t = 1.0 + x
+        return rho_0 / (x * t * t * np.sqrt(t))
 
     return RadialProfile(_snfw)
 
@@ -401,7 +436,8 @@ def snfw_mass_profile(M, a):
 
     def _snfw(r):
         x = r / a
-        return M * (1.0 - (2.0 + 3.0 * x) / (2.0 * (1.0 + x) ** 1.5))
+        t = 1.0 + x
+        return M * (1.0 - (2.0 + 3.0 * x) / (2.0 * t * np.sqrt(t)))
 
     return RadialProfile(_snfw)
 
@@ -440,12 +476,12 @@ def cored_snfw_density_profile(M, a, r_c):
         The core radius in kpc.
     """
     b = a / r_c
+    rho_0 = 3.0 * M * b / (16.0 * np.pi * a**3)
 
     def _snfw(r):
         x = r / a
-        return (
-            3.0 * M * b / (16.0 * np.pi * a**3) / ((1.0 + b * x) * (1.0 + x) ** 2.5)
-        )
+        t = 1.0 + x
+        return rho_0 / ((1.0 + b * x) * t * t * np.sqrt(t))
 
     return RadialProfile(_snfw)
 
@@ -465,16 +501,24 @@ def cored_snfw_mass_profile(M, a, r_c):
         The core radius in kpc.
     """
     b = a / r_c
+    e = b * (b - 1.0) ** 2
+    # d = sqrt(b / (1 - b)) is imaginary for b > 1, where d * arctan(y * d)
+    # has real part -|d| * arccoth(y * |d|), so both branches stay real.
+    if b < 1.0:
+        d = np.sqrt(b / (1.0 - b))
+        _atan = lambda y: d * np.arctan(y * d)
+    else:
+        d = np.sqrt(b / (b - 1.0))
+        _atan = lambda y: -d * np.arctanh(1.0 / (y * d))
+    atan0 = _atan(1.0)
 
     def _snfw(r):
         x = r / a
-        y = np.complex128(np.sqrt(x + 1.0))
-        d = np.sqrt(np.complex128(b / (1.0 - b)))
-        e = b * (b - 1.0) ** 2
+        y = np.sqrt(x + 1.0)
         ret = (1.0 - 1.0 / y) * (b - 2.0) / (b - 1.0) ** 2
-        ret += (1.0 / y**3 - 1.0) / (3.0 * (b - 1.0))
-        ret += d * (np.arctan(y * d) - np.arctan(d)) / e
-        return 1.5 * M * b * ret.astype("float64")
+        ret += (1.0 / (y * y * y) - 1.0) / (3.0 * (b - 1.0))
+        ret += (_atan(y) - atan0) / e
+        return 1.5 * M * b * ret
 
     return RadialProfile(_snfw)
 
@@ -561,14 +605,14 @@ def einasto_mass_profile(M, r_s, n):
     n : float
         The inverse power-law index.
     """
-    from scipy.special import gammaincc
+    from scipy.special import gammainc
 
     alpha = 1.0 / n
     h = r_s / _dn(n) ** n
 
     def _einasto(r):
         s = r / h
-        return M * (1.0 - gammaincc(3.0 * n, s**alpha))
+        return M * gammainc(3.0 * n, s**alpha)
 
     return RadialProfile(_einasto)
 
@@ -593,13 +637,12 @@ def am06_density_profile(rho_0, a, a_c, c, n):
     """
     alpha = -1.0 - n * (c - 1.0) / (c - a / a_c)
     beta = 1.0 - n * (1.0 - a / a_c) / (c - a / a_c)
-    p = (
-        lambda r: rho_0
-        * (1.0 + r / a_c)
-        * (1.0 + r / a_c / c) ** alpha
-        * (1.0 + r / a) ** beta
-    )
-    return RadialProfile(p)
+
+    def _am06(r):
+        x = r / a_c
+        return rho_0 * (1.0 + x) * (1.0 + x / c) ** alpha * (1.0 + r / a) ** beta
+
+    return RadialProfile(_am06)
 
 
 def vikhlinin_density_profile(rho_0, r_c, r_s, alpha, beta, epsilon, gamma=None):
@@ -628,13 +671,20 @@ def vikhlinin_density_profile(rho_0, r_c, r_s, alpha, beta, epsilon, gamma=None)
     """
     if gamma is None:
         gamma = 3.0
-    profile = (
-        lambda r: rho_0
-        * (r / r_c) ** (-0.5 * alpha)
-        * (1.0 + (r / r_c) ** 2) ** (-1.5 * beta + 0.25 * alpha)
-        * (1.0 + (r / r_s) ** gamma) ** (-0.5 * epsilon / gamma)
-    )
-    return RadialProfile(profile)
+    p_inner = -0.5 * alpha
+    p_core = -1.5 * beta + 0.25 * alpha
+    p_outer = -0.5 * epsilon / gamma
+
+    def _vikhlinin(r):
+        x = r / r_c
+        return (
+            rho_0
+            * x**p_inner
+            * (1.0 + x * x) ** p_core
+            * (1.0 + (r / r_s) ** gamma) ** p_outer
+        )
+
+    return RadialProfile(_vikhlinin)
 
 
 def vikhlinin_temperature_profile(T_0, a, b, c, r_t, T_min, r_cool, a_cool):
@@ -663,10 +713,13 @@ def vikhlinin_temperature_profile(T_0, a, b, c, r_t, T_min, r_cool, a_cool):
         The logarithmic slope in the cooling region.
     """
 
+    t_ratio = T_min / T_0
+
     def _temp(r):
         x = (r / r_cool) ** a_cool
-        t = (r / r_t) ** (-a) / ((1.0 + (r / r_t) ** b) ** (c / b))
-        return T_0 * t * (x + T_min / T_0) / (x + 1)
+        y = r / r_t
+        t = y ** (-a) / ((1.0 + y**b) ** (c / b))
+        return T_0 * t * (x + t_ratio) / (x + 1)
 
     return RadialProfile(_temp)
 
@@ -688,8 +741,12 @@ def am06_temperature_profile(T_0, a, a_c, c):
     c : float
         The scale of the temperature drop of the cool core.
     """
-    p = lambda r: T_0 / (1.0 + r / a) * (c + r / a_c) / (1.0 + r / a_c)
-    return RadialProfile(p)
+
+    def _am06(r):
+        x = r / a_c
+        return T_0 / (1.0 + r / a) * (c + x) / (1.0 + x)
+
+    return RadialProfile(_am06)
 
 
 def baseline_entropy_profile(K_0, K_200, r_200, alpha):
@@ -724,7 +781,7 @@ def broken_entropy_profile(r_s, K_scale, alpha, K_0=0.0):
 def walker_entropy_profile(r_200, A, B, K_scale, alpha=1.1):
     def _entr(r):
         x = r / r_200
-        return K_scale * (A * x**alpha) * np.exp(-((x / B) ** 2))
+        return K_scale * A * x**alpha * np.exp(-((x / B) ** 2))
 
     return RadialProfile(_entr)
 
@@ -780,11 +837,7 @@ def find_overdensity_radius(m, delta, z=0.0, cosmo=None):
         density. If not supplied, a default one from yt will
         be used.
     """
-    from yt.utilities.cosmology import Cosmology
-
-    if cosmo is None:
-        cosmo = Cosmology()
-    rho_crit = cosmo.critical_density(z).to_value("Msun/kpc**3")
+    rho_crit = _critical_density(z, cosmo)
     return (3.0 * m / (4.0 * np.pi * delta * rho_crit)) ** (1.0 / 3.0)
 
 
@@ -795,8 +848,9 @@ def find_radius_mass(m_r, delta, z=0.0, cosmo=None):
 
     Parameters
     ----------
-    m_r : RadialProfile
-        The mass profile.
+    m_r : RadialProfile or callable
+        The mass profile. Callables that only accept scalar radii
+        are also supported.
     delta : float
         The overdensity to compute the mass and radius for.
     z : float, optional
@@ -806,12 +860,27 @@ def find_radius_mass(m_r, delta, z=0.0, cosmo=None):
         density. If not supplied, a default one from yt will
         be used.
     """
-    from scipy.optimize import bisect
-    from yt.utilities.cosmology import Cosmology
+    from scipy.optimize import brentq
 
-    if cosmo is None:
-        cosmo = Cosmology()
-    rho_crit = cosmo.critical_density(z).to_value("Msun/kpc**3")
+    rho_crit = _critical_density(z, cosmo)
     f = lambda r: 3.0 * m_r(r) / (4.0 * np.pi * r**3) - delta * rho_crit
-    r_delta = bisect(f, 0.01, 10000.0)
+    # Find the sign change on a coarse log grid in one vectorized call, so
+    # the root finder starts from a bracket a factor of ~1.5 wide rather
+    # than six decades. Mass profiles that only take scalars are evaluated
+    # pointwise.
+    rr = np.geomspace(0.01, 10000.0, 33)
+    try:
+        fr = np.asarray(f(rr), dtype="float64")
+    except (TypeError, ValueError):
+        fr = None
+    if fr is None or fr.shape != rr.shape:
+        fr = np.vectorize(f, otypes=["float64"])(rr)
+    below = fr < 0.0
+    if below[0] or not below.any():
+        raise ValueError(
+            f"The radius with an overdensity of {delta} is not between "
+            f"{rr[0]} and {rr[-1]} kpc for this mass profile!"
+        )
+    i = np.argmax(below)
+    r_delta = brentq(f, rr[i - 1], rr[i])
     return r_delta, m_r(r_delta)
@@ -7,7 +7,10 @@ import os
 
 import numpy as np
 
+from cluster_generator.model import ClusterModel
+from cluster_generator.radial_profiles import hernquist_density_profile
 from cluster_generator.tests.utils import generate_model, model_answer_testing
+from cluster_generator.utils import G
 
 
 def test_model_build(answer_store: bool, answer_dir: str, temp_dir: str):
@@ -38,3 +41,17 @@ def test_model_build(answer_store: bool, answer_dir: str, temp_dir: str):
 
     # Check HSE
     assert np.all(m.check_hse() < 1.0e-4)
+
+
+def test_model_potential():
+    """
+    Test the gravitational potential of a Hernquist model against the
+    analytic potential, truncated at the outer radius of the model.
+    """
+    M, a, rmax = 1.0e14, 500.0, 10000.0
+    m = ClusterModel.no_gas(0.1, rmax, hernquist_density_profile(M, a))
+    rr = m["radius"].to_value("kpc")
+    pot = -G.v * M * (1.0 / (rr + a) - a / (rmax + a) ** 2)
+    np.testing.assert_allclose(
+        m["gravitational_potential"].to_value("kpc**2/Myr**2"), pot, rtol=5.0e-8
+    )
@@ -1,8 +1,17 @@
 """
 Pytest suite for unit-testing the particle generation system.
 """
+import os
+
+import h5py
+import numpy as np
 import pytest
+from numpy.random import RandomState
+from numpy.testing import assert_allclose, assert_equal
+from unyt import unyt_array, unyt_quantity
 
+from cluster_generator.opt.cython_utils import box_mask, radial_mask
+from cluster_generator.particles import ClusterParticles, gadget_field_units
 from cluster_generator.tests.utils import get_base_model, particle_answer_testing, prng
 
 
@@ -20,3 +29,100 @@ def test_particles(answer_store: bool, answer_dir: str, temp_dir: str):
     hp = m.generate_gas_particles(100000, prng=prng)
     parts = hp + dp + sp
     particle_answer_testing(parts, "model_particles.h5", answer_store, answer_dir)
+
+
+def test_gadget_magnetic_field_units(temp_dir: str):
+    """
+    Test that a magnetic field read back in SI units is converted to the
+    Gadget code units when writing a Gadget file.
+    """
+    prng = RandomState(25)
+    n = 100
+    fields = {
+        ("gas", "particle_mass"): unyt_array(np.ones(n), "Msun"),
+        ("gas", "particle_position"): unyt_array(
+            prng.uniform(0.0, 1000.0, size=(n, 3)), "kpc"
+        ),
+        ("gas", "particle_velocity"): unyt_array(np.zeros((n, 3)), "kpc/Myr"),
+        ("gas", "magnetic_field"): unyt_array(
+            prng.normal(scale=1.0e-6, size=(n, 3)), "gauss"
+        ),
+    }
+    parts = ClusterParticles.from_fields(fields)
+    parts_fn = os.path.join(temp_dir, "bfield_particles.h5")
+    parts.write_particles(parts_fn, overwrite=True)
+    parts = ClusterParticles.from_file(parts_fn)
+
+    gadget_fn = os.path.join(temp_dir, "bfield_gadget.h5")
+    parts.write_to_gadget_file(gadget_fn, 1000.0, dtype="float64", overwrite=True)
+    with h5py.File(gadget_fn, "r") as f:
+        b = f["PartType0"]["MagneticField"][()]
+    expected = fields["gas", "magnetic_field"].to_value(
+        gadget_field_units["MagneticField"]
+    )
+    assert_allclose(b, expected, rtol=1.0e-12)
+
+
+def test_radial_mask():
+    """
+    Test the Cython radial mask against the equivalent NumPy expression.
+    """
+    prng = RandomState(25)
+    pos = prng.uniform(-10.0, 10.0, size=(1000, 3))
+    # points exactly on and just outside the sphere
+    pos[:3] = [[1.0, 3.0, 4.0], [1.0, 8.0, 0.0], [1.0, 3.0, 4.0 + 1.0e-12]]
+    center = np.array([1.0, 0.0, 0.0])
+    r2 = 25.0
+    expected = ((pos - center) ** 2).sum(axis=1) <= r2
+    mask = radial_mask(pos, center, r2)
+    assert mask.dtype == bool
+    assert_equal(mask, expected)
+    assert_equal(mask[:3], [True, False, False])
+
+
+def test_box_mask():
+    """
+    Test the Cython box mask against the equivalent NumPy expression.
+    """
+    prng = RandomState(25)
+    box_size = 10.0
+    pos = prng.uniform(-2.0, 12.0, size=(1000, 3))
+    # points on the faces and corners of the box, and just outside them
+    pos[:4] = [
+        [0.0, 5.0, 10.0],
+        [10.0, 10.0, 10.0],
+        [-1.0e-12, 5.0, 5.0],
+        [5.0, 5.0, 10.0 + 1.0e-12],
+    ]
+    expected = np.all((pos >= 0.0) & (pos <= box_size), axis=1)
+    mask = box_mask(pos, box_size)
+    assert mask.dtype == bool
+    assert_equal(mask, expected)
+    assert_equal(mask[:4], [True, True, False, False])
+
+
+def test_masks_float32_and_units():
+    """
+    Test radial cuts and box clipping on single-precision positions, with
+    the radius, center, and box size given in units other than kpc.
+    """
+    prng = RandomState(25)
+    n = 1000
+    pos = prng.uniform(0.0, 2000.0, size=(n, 3)).astype("float32")
+    fields = {
+        ("dm", "particle_mass"): unyt_array(np.ones(n), "Msun"),
+        ("dm", "particle_position"): unyt_array(pos, "kpc"),
+    }
+    parts = ClusterParticles.from_fields(fields)
+
+    box_size = unyt_quantity(1.0, "Mpc")
+    expected = np.all(pos <= box_size.to_value("kpc"), axis=1)
+    assert_equal(parts._clip_to_box("dm", box_size), expected)
+
+    r_max = unyt_quantity(0.5, "Mpc")
+    center = unyt_array([1.0, 1.0, 1.0], "Mpc")
+    dr = pos.astype("float64") - center.to_value("kpc")
+    keep = (dr * dr).sum(axis=1) <= r_max.to_value("kpc") ** 2
+    parts.make_radial_cut(r_max, center=center)
+    assert parts.num_particles["dm"] == keep.sum()
+    assert_equal(parts["dm", "particle_position"].d, pos[keep])
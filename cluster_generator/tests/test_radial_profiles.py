@@ -11,7 +11,7 @@ import pytest
 from numpy.testing import assert_array_equal
 
 import cluster_generator.radial_profiles as rp
-from cluster_generator.utils import integrate_mass
+from cluster_generator.utils import integrate_mass, integrate_mass_cumulative
 
 _params = (
     {  # Stores all of the parameters for the generation of each of the test cases.
@@ -82,6 +82,51 @@ class TestUtilities:
 
         np.testing.assert_allclose(int, answer_profile(rr))
 
+    def test_integrate_mass_cumulative(self):
+        rr = np.geomspace(0.1, 10000, 1000)  # the integration domain
+        profile = lambda x: (1 / (2 * np.pi)) * (500 / x) * (1 / (500 + x) ** 3)
+        answer_profile = lambda x: (x / (500 + x)) ** 2
+
+        int = integrate_mass_cumulative(profile, rr)
+
+        np.testing.assert_allclose(int, answer_profile(rr), rtol=5.0e-8)
+
+    def test_tnfw_mass_profile(self):
+        rr = np.geomspace(0.1, 10000, 1000)  # the integration domain
+        density = rp.tnfw_density_profile(1.0e6, 300, 1200)
+        mass = rp.tnfw_mass_profile(1.0e6, 300, 1200)
+
+        np.testing.assert_allclose(mass(rr), integrate_mass(density, rr), rtol=1.0e-6)
+
+    @pytest.mark.parametrize("r_c", [400.0, 50.0])
+    def test_cored_snfw_mass_profile(self, r_c):
+        # The closed form loses digits to cancellation well inside r_c.
+        rr = np.geomspace(1.0, 10000, 1000)  # the integration domain
+        density = rp.cored_snfw_density_profile(1.0e14, 200, r_c)
+        mass = rp.cored_snfw_mass_profile(1.0e14, 200, r_c)
+
+        np.testing.assert_allclose(mass(rr), integrate_mass(density, rr), rtol=1.0e-6)
+
+    def test_find_radius_mass(self):
+        mass = rp.snfw_mass_profile(1.0e15, 400.0)
+        r200, m200 = rp.find_radius_mass(mass, 200.0, z=0.1)
+        np.testing.assert_allclose(
+            r200, rp.find_overdensity_radius(m200, 200.0, z=0.1), rtol=1.0e-8
+        )
+
+        # a mass profile that only accepts scalar radii
+        scalar_mass = lambda r: float(mass(r))
+        with pytest.raises(TypeError):
+            scalar_mass(np.geomspace(1.0, 10.0, 3))
+        r, m = rp.find_radius_mass(scalar_mass, 200.0, z=0.1)
+        np.testing.assert_allclose([r, m], [r200, m200], rtol=1.0e-12)
+
+    @pytest.mark.parametrize("m_tot", [1.0e-3, 1.0e25])
+    def test_find_radius_mass_out_of_range(self, m_tot):
+        mass = rp.constant_profile(m_tot)
+        with pytest.raises(ValueError, match="overdensity of 200.0"):
+            rp.find_radius_mass(mass, 200.0)
+
 
 @pytest.mark.filterwarnings("ignore:Casting")
 @pytest.mark.skip(reason="Implementation not-complete.")
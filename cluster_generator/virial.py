@@ -10,7 +10,13 @@ from unyt import unyt_array
 
 from cluster_generator.opt.cython_utils import generate_velocities
 from cluster_generator.particles import ClusterParticles
-from cluster_generator.utils import cgparams, generate_particle_radii, mylog, quad
+from cluster_generator.utils import (
+    cgparams,
+    generate_particle_radii,
+    mylog,
+    quad,
+    spherical_to_cartesian,
+)
 
 
 class VirialEquilibrium:
@@ -132,7 +138,8 @@ class VirialEquilibrium:
         compute_potential : boolean, optional
             If True, the gravitational potential for each particle will
             be computed. Default: False
-        prng : :class:`~numpy.random.RandomState` object, integer, or None
+        prng : :class:`~numpy.random.RandomState` or
+            :class:`~numpy.random.Generator` object, integer, or None
             A pseudo-random number generator. Typically will only
             be specified if you have a reason to generate the same
             set of random numbers, such as for a test. Default is None,
@@ -172,19 +179,14 @@ class VirialEquilibrium:
         else:
             radius = radius_sub
 
-        theta = np.arccos(prng.uniform(low=-1.0, high=1.0, size=num_particles))
+        cos_theta = prng.uniform(low=-1.0, high=1.0, size=num_particles)
         phi = 2.0 * np.pi * prng.uniform(size=num_particles)
 
         fields = OrderedDict()
 
         fields[key, "particle_position"] = unyt_array(
-            [
-                radius * np.sin(theta) * np.cos(phi),
-                radius * np.sin(theta) * np.sin(phi),
-                radius * np.cos(theta),
-            ],
-            "kpc",
-        ).T
+            spherical_to_cartesian(radius, cos_theta, phi), "kpc"
+        )
 
         mylog.info("Compute %s particle velocities.", self.ptype)
 
@@ -208,17 +210,12 @@ class VirialEquilibrium:
         else:
             velocity = velocity_sub
 
-        theta = np.arccos(prng.uniform(low=-1.0, high=1.0, size=num_particles))
+        cos_theta = prng.uniform(low=-1.0, high=1.0, size=num_particles)
         phi = 2.0 * np.pi * prng.uniform(size=num_particles)
 
         fields[key, "particle_velocity"] = unyt_array(
-            [
-                velocity * np.sin(theta) * np.cos(phi),
-                velocity * np.sin(theta) * np.sin(phi),
-                velocity * np.cos(theta),
-            ],
-            "kpc/Myr",
-        ).T
+            spherical_to_cartesian(velocity, cos_theta, phi), "kpc/Myr"
+        )
 
         fields[key, "particle_mass"] = unyt_array(
             [mtot / num_particles] * num_particles, "Msun"